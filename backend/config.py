@@ -30,12 +30,21 @@ JWT_EXPIRATION_MINUTES = 60 * 24  # 24 hours
 # WebSocket settings
 WS_PING_INTERVAL = 30  # seconds
 WS_TIMEOUT = 60  # seconds
+WS_LOG_LEVEL = os.getenv("WS_LOG_LEVEL", "INFO").upper()  # DEBUG enables per-message logs
 
 # Device settings
 MAX_FRAME_SIZE = 5 * 1024 * 1024  # 5MB
 CAMERA_FPS_LIMIT = 10
+FRAMES_PER_CAMERA = 10  # saved frames kept on disk per camera
+THUMBNAIL_SCALE = (1, 4)  # preview thumbnail size relative to the frame
+THUMBNAIL_QUALITY = 70
 LOCATION_UPDATE_INTERVAL = 10  # seconds
 
+# File storage settings
+APPEND_FLUSH_INTERVAL = 0.2  # seconds between JSONL buffer flushes
+APPEND_FLUSH_BYTES = 64 * 1024  # flush a JSONL buffer early once it grows past this
+JSONL_SEGMENT_BYTES = 4 * 1024 * 1024  # rotate and zstd-compress JSONL files past this size
+
 # Database settings
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
@@ -12,7 +12,7 @@ from backend.auth.router import router as auth_router, decode_access_token
 from backend.devices.router import router as devices_router
 from backend.devices.api_router import router as device_api_router
 from backend.devices.device_api import router as new_device_api_router
-from backend.websocket.handler import ws_manager
+from backend.websocket.handler import ws_manager, start_log_listener, stop_log_listener
 from backend.models import DeviceInfo
 from backend.database import init_db
 
@@ -27,6 +27,7 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
+    start_log_listener()
     try:
         # Run migrations via Alembic (handled by deployment)
         # Just verify connection
@@ -38,6 +39,12 @@ async def startup_event():
         print(f"Database connection error: {e}")
         # Continue anyway - migrations will be run by deployment script
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued websocket log records"""
+    stop_log_listener()
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -182,10 +189,20 @@ async def websocket_device(websocket: WebSocket, token: Optional[str] = None):
         message_count = 0
         while True:
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                received = await websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+                
                 message_count += 1
-                await ws_manager.handle_device_message(device_id, message)
+                if received.get("bytes") is not None:
+                    # Binary message: camera frame without Base64/JSON wrapping
+                    await ws_manager.handle_device_frame(device_id, received["bytes"])
+                else:
+                    data = received["text"]
+                    message = json.loads(data)
+                    await ws_manager.handle_device_message(device_id, message)
+            except WebSocketDisconnect:
+                raise
             except json.JSONDecodeError as json_error:
                 print(f"[WS_MESSAGE_ERROR] Failed to parse JSON from device {device_id}: {json_error}")
                 print(f"[WS_MESSAGE_ERROR] Raw data: {data[:200]}...")
@@ -0,0 +1,23 @@
+"""Whole-file async I/O helpers"""
+import asyncio
+from pathlib import Path
+
+
+def _write_file(path: Path, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _read_file(path: Path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def write_file(path: Path, data: bytes):
+    """Write a whole file in a single worker-thread submission"""
+    await asyncio.to_thread(_write_file, path, data)
+
+
+async def read_file(path: Path) -> bytes:
+    """Read a whole file in a single worker-thread submission"""
+    return await asyncio.to_thread(_read_file, path)
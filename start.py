@@ -2,9 +2,28 @@
 """Quick start script for local development"""
 import os
 import sys
-import subprocess
+import runpy
+import importlib
+from importlib.util import find_spec
 from pathlib import Path
 
+def install_requirements():
+    """Run pip in this interpreter instead of spawning a new one"""
+    # pip's __main__ drops the cwd from sys.path; restore it with argv,
+    # otherwise "backend" is no longer importable afterwards
+    argv, path = sys.argv, sys.path[:]
+    sys.argv = ["pip", "install", "-r", "requirements.txt"]
+    try:
+        runpy.run_module("pip", run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        if e.code:
+            print("ERROR: pip install failed")
+            sys.exit(e.code)
+    finally:
+        sys.argv = argv
+        sys.path[:] = path
+    importlib.invalidate_caches()
+
 def main():
     print("Starting Kelya Virus locally...")
     
@@ -22,15 +41,13 @@ def main():
     
     # Check and install dependencies
     print("Checking dependencies...")
-    try:
-        import uvicorn
-        from jose import JWTError
-        from passlib.context import CryptContext
+    missing = [m for m in ("uvicorn", "jose", "passlib") if find_spec(m) is None]
+    if not missing:
         print("OK: Dependencies OK")
-    except ImportError as e:
-        print("WARNING: Missing dependency: " + str(e))
+    else:
+        print("WARNING: Missing dependency: " + ", ".join(missing))
         print("Installing dependencies from requirements.txt...")
-        subprocess.run([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"], check=True)
+        install_requirements()
         print("OK: Dependencies installed")
     
     # Set environment variables
@@ -46,6 +63,8 @@ def main():
     print("Server: http://127.0.0.1:5000")
     print("API docs: http://127.0.0.1:5000/docs")
     print("Login: admin / admin123")
+    reload = os.environ.get("KELYA_RELOAD") == "1"
+    print("Auto-reload: " + ("ON" if reload else "OFF (set KELYA_RELOAD=1 to enable)"))
     print("\nPress Ctrl+C to stop\n")
     
     # Run uvicorn
@@ -54,7 +73,7 @@ def main():
         "backend.main:app",
         host="127.0.0.1",
         port=5000,
-        reload=True
+        reload=reload
     )
 
 if __name__ == "__main__":
@@ -1,392 +1,245 @@
 # -*- coding: utf-8 -*-
 """Тест нового API с device_id в пути и Bearer token"""
-import requests
-import base64
+import sys
+import json
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import BytesIO
-
-try:
-    from PIL import Image
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
 
 BASE_URL = "http://127.0.0.1:5000"
 DEVICE_ID = str(uuid.uuid4())
+NOW_ISO = datetime.now().isoformat()  # Одна временная метка на весь прогон
 
-print(f"[TEST] Тестирование нового API (device_id в пути, Bearer token)")
-print(f"[INFO] Сервер: {BASE_URL}")
-print(f"[INFO] Device ID: {DEVICE_ID}\n")
-
-# Сначала регистрируем устройство и получаем токен
-print("[SETUP] Регистрация устройства...")
+# Keep-alive сессии: устройство и админ, у каждой свой Authorization по умолчанию
 try:
-    register_r = requests.post(f"{BASE_URL}/api/device/register", data={
-        "device_id": DEVICE_ID,
+    # httpx: пул соединений без слоев Session -> HTTPAdapter, клиент потокобезопасен
+    import httpx
+    device_session = httpx.Client(timeout=None)
+    admin_session = httpx.Client(timeout=None)
+    RAW_BODY = "content"  # Аргумент post() для готового тела в байтах
+except ImportError:
+    import requests
+    device_session = requests.Session()
+    admin_session = requests.Session()
+    RAW_BODY = "data"
+
+# Тестовый кадр для camera-frame: встроенный JPEG 1x1 (красный пиксель), без Pillow
+FRAME_SIZE = (1, 1)
+img_base64 = "/9j/4AAQSkZJRgABAQEAYABgAAD/2wBDAAEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQH/2wBDAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQH/wAARCAABAAEDASIAAhEBAxEB/8QAFQABAQAAAAAAAAAAAAAAAAAAAAv/xAAUEAEAAAAAAAAAAAAAAAAAAAAA/8QAFQEBAQAAAAAAAAAAAAAAAAAAAAX/xAAUEQEAAAAAAAAAAAAAAAAAAAAA/9oADAMBAAIRAxEAPwA/wA=="
+
+# Таблица тестов (endpoint, тело запроса); тела сериализуются один раз ниже.
+# Endpoints независимы - отправляем параллельно через общий device_session
+TESTS = [
+    ("battery", {
+        "level": 85,
+        "is_charging": True,
+        "temperature": 32.5,
+        "voltage": 4.2,
+        "health": "good",
+        "timestamp": NOW_ISO
+    }),
+    ("device-info", {
         "manufacturer": "Samsung",
-        "model": "Galaxy S21",
-        "android_version": "12",
-        "sdk": 31,
-        "imei": "123456789012345"
-    })
-    if register_r.status_code != 200:
-        print(f"   [ERROR] Регистрация не удалась: {register_r.status_code}")
-        print(f"   Ответ: {register_r.text}")
+        "model": "Galaxy S21 Ultra",
+        "android_version": "13",
+        "sdk_version": 33,
+        "serial_number": "ABC123",
+        "imei": "123456789012345",
+        "timestamp": NOW_ISO
+    }),
+    ("location", {
+        "latitude": 48.4647,
+        "longitude": 35.0462,
+        "accuracy": 10.5,
+        "altitude": 150.0,
+        "speed": 0.0,
+        "timestamp": NOW_ISO
+    }),
+    ("camera-frame", {
+        "camera": "back",
+        "image_base64": img_base64,
+        "width": FRAME_SIZE[0],
+        "height": FRAME_SIZE[1],
+        "timestamp": NOW_ISO
+    }),
+    ("logs", {
+        "logs": [
+            {
+                "level": "info",
+                "message": "App started",
+                "timestamp": NOW_ISO
+            },
+            {
+                "level": "error",
+                "message": "Connection failed",
+                "timestamp": NOW_ISO
+            }
+        ],
+        "timestamp": NOW_ISO
+    }),
+    ("system-stats", {
+        "ram_total": 8192,
+        "ram_used": 4096,
+        "ram_free": 4096,
+        "cpu_usage": 45.2,
+        "storage_total": 128000,
+        "storage_used": 64000,
+        "storage_free": 64000,
+        "timestamp": NOW_ISO
+    }),
+    ("apps", {
+        "apps": [
+            {
+                "package_name": "com.example.app",
+                "app_name": "Example App",
+                "version": "1.0.0",
+                "install_time": NOW_ISO
+            }
+        ],
+        "timestamp": NOW_ISO
+    }),
+    ("contacts", {
+        "contacts": [
+            {
+                "name": "John Doe",
+                "phone": "+380123456789",
+                "email": "john@example.com"
+            }
+        ],
+        "timestamp": NOW_ISO
+    }),
+    ("sms", {
+        "messages": [
+            {
+                "sender": "+380123456789",
+                "body": "Hello",
+                "timestamp": NOW_ISO,
+                "is_read": True
+            }
+        ],
+        "timestamp": NOW_ISO
+    }),
+    ("call-logs", {
+        "calls": [
+            {
+                "number": "+380123456789",
+                "type": "incoming",
+                "duration": 120,
+                "timestamp": NOW_ISO
+            }
+        ],
+        "timestamp": NOW_ISO
+    }),
+    ("heartbeat", {
+        "status": "online",
+        "timestamp": NOW_ISO
+    }),
+]
+
+# Готовые JSON байты: json.dumps не выполняется в рабочих потоках
+PAYLOADS = [(name, json.dumps(body, separators=(",", ":")).encode()) for name, body in TESTS]
+
+def run_test(name, payload):
+    """POST /api/devices/{device_id}/<name> с готовым JSON телом, возвращает (успех, описание)"""
+    try:
+        r = device_session.post(f"{BASE_URL}/api/devices/{DEVICE_ID}/{name}", **{RAW_BODY: payload})
+        if r.status_code == 200:
+            return True, f"[OK] Успешно: {r.json()}"
+        return False, f"[ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}"
+    except Exception as e:
+        return False, f"[ERROR] Ошибка: {e}"
+
+
+def run(out):
+    """Сценарий теста; строки вывода передаются в out"""
+    out(f"[TEST] Тестирование нового API (device_id в пути, Bearer token)")
+    out(f"[INFO] Сервер: {BASE_URL}")
+    out(f"[INFO] Device ID: {DEVICE_ID}\n")
+
+    # Сначала регистрируем устройство и получаем токен
+    out("[SETUP] Регистрация устройства...")
+    try:
+        register_r = device_session.post(f"{BASE_URL}/api/device/register", data={
+            "device_id": DEVICE_ID,
+            "manufacturer": "Samsung",
+            "model": "Galaxy S21",
+            "android_version": "12",
+            "sdk": 31,
+            "imei": "123456789012345"
+        })
+        if register_r.status_code != 200:
+            out(f"   [ERROR] Регистрация не удалась: {register_r.status_code}")
+            out(f"   Ответ: {register_r.text}")
+            exit(1)
+        out("   [OK] Устройство зарегистрировано\n")
+    except Exception as e:
+        out(f"   [ERROR] Ошибка регистрации: {e}\n")
         exit(1)
-    print("   [OK] Устройство зарегистрировано\n")
-except Exception as e:
-    print(f"   [ERROR] Ошибка регистрации: {e}\n")
-    exit(1)
 
-# Получаем токен устройства
-print("[SETUP] Получение токена устройства...")
-try:
-    # Логинимся как админ
-    login_r = requests.post(f"{BASE_URL}/api/auth/login", json={
-        "username": "admin",
-        "password": "admin123"
-    })
-    if login_r.status_code != 200:
-        print(f"   [ERROR] Логин не удался: {login_r.status_code}")
-        exit(1)
-    
-    admin_token = login_r.json()["access_token"]
-    headers = {"Authorization": f"Bearer {admin_token}"}
-    
     # Получаем токен устройства
-    token_r = requests.get(f"{BASE_URL}/api/devices/{DEVICE_ID}/token", headers=headers)
-    if token_r.status_code != 200:
-        print(f"   [ERROR] Не удалось получить токен: {token_r.status_code}")
-        print(f"   Ответ: {token_r.text}")
+    out("[SETUP] Получение токена устройства...")
+    try:
+        # Логинимся как админ
+        login_r = admin_session.post(f"{BASE_URL}/api/auth/login", json={
+            "username": "admin",
+            "password": "admin123"
+        })
+        if login_r.status_code != 200:
+            out(f"   [ERROR] Логин не удался: {login_r.status_code}")
+            exit(1)
+
+        admin_token = login_r.json()["access_token"]
+        admin_session.headers["Authorization"] = f"Bearer {admin_token}"
+
+        # Получаем токен устройства
+        token_r = admin_session.get(f"{BASE_URL}/api/devices/{DEVICE_ID}/token")
+        if token_r.status_code != 200:
+            out(f"   [ERROR] Не удалось получить токен: {token_r.status_code}")
+            out(f"   Ответ: {token_r.text}")
+            exit(1)
+
+        device_token = token_r.json()["token"]
+        device_session.headers["Authorization"] = f"Bearer {device_token}"
+        device_session.headers["Content-Type"] = "application/json"
+        out(f"   [OK] Токен получен: {device_token[:20]}...\n")
+    except Exception as e:
+        out(f"   [ERROR] Ошибка получения токена: {e}\n")
         exit(1)
-    
-    device_token = token_r.json()["token"]
-    device_headers = {"Authorization": f"Bearer {device_token}", "Content-Type": "application/json"}
-    print(f"   [OK] Токен получен: {device_token[:20]}...\n")
-except Exception as e:
-    print(f"   [ERROR] Ошибка получения токена: {e}\n")
-    exit(1)
-
-# Теперь тестируем endpoints
-test_results = []
-
-# 1. Battery
-print("[1] Тест POST /api/devices/{device_id}/battery...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/battery",
-        headers=device_headers,
-        json={
-            "level": 85,
-            "is_charging": True,
-            "temperature": 32.5,
-            "voltage": 4.2,
-            "health": "good",
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("battery", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("battery", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("battery", False))
-
-# 2. Device Info
-print("\n[2] Тест POST /api/devices/{device_id}/device-info...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/device-info",
-        headers=device_headers,
-        json={
-            "manufacturer": "Samsung",
-            "model": "Galaxy S21 Ultra",
-            "android_version": "13",
-            "sdk_version": 33,
-            "serial_number": "ABC123",
-            "imei": "123456789012345",
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("device-info", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("device-info", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("device-info", False))
-
-# 3. Location
-print("\n[3] Тест POST /api/devices/{device_id}/location...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/location",
-        headers=device_headers,
-        json={
-            "latitude": 48.4647,
-            "longitude": 35.0462,
-            "accuracy": 10.5,
-            "altitude": 150.0,
-            "speed": 0.0,
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("location", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("location", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("location", False))
-
-# 4. Camera Frame
-print("\n[4] Тест POST /api/devices/{device_id}/camera-frame...")
-try:
-    if HAS_PIL:
-        # Создаем тестовое изображение
-        img = Image.new('RGB', (1920, 1080), color='blue')
-        img_bytes = BytesIO()
-        img.save(img_bytes, format='JPEG')
-        img_bytes.seek(0)
-        img_base64 = base64.b64encode(img_bytes.read()).decode('utf-8')
-    else:
-        # Простой тестовый base64 (1x1 красный пиксель)
-        img_base64 = "/9j/4AAQSkZJRgABAQEAYABgAAD/2wBDAAEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQH/2wBDAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQH/wAARCAABAAEDASIAAhEBAxEB/8QAFQABAQAAAAAAAAAAAAAAAAAAAAv/xAAUEAEAAAAAAAAAAAAAAAAAAAAA/8QAFQEBAQAAAAAAAAAAAAAAAAAAAAX/xAAUEQEAAAAAAAAAAAAAAAAAAAAA/9oADAMBAAIRAxEAPwA/wA=="
-    
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/camera-frame",
-        headers=device_headers,
-        json={
-            "camera": "back",
-            "image_base64": img_base64,
-            "width": 1920,
-            "height": 1080,
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("camera-frame", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("camera-frame", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("camera-frame", False))
-
-# 5. Logs
-print("\n[5] Тест POST /api/devices/{device_id}/logs...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/logs",
-        headers=device_headers,
-        json={
-            "logs": [
-                {
-                    "level": "info",
-                    "message": "App started",
-                    "timestamp": datetime.now().isoformat()
-                },
-                {
-                    "level": "error",
-                    "message": "Connection failed",
-                    "timestamp": datetime.now().isoformat()
-                }
-            ],
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("logs", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("logs", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("logs", False))
-
-# 6. System Stats
-print("\n[6] Тест POST /api/devices/{device_id}/system-stats...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/system-stats",
-        headers=device_headers,
-        json={
-            "ram_total": 8192,
-            "ram_used": 4096,
-            "ram_free": 4096,
-            "cpu_usage": 45.2,
-            "storage_total": 128000,
-            "storage_used": 64000,
-            "storage_free": 64000,
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("system-stats", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("system-stats", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("system-stats", False))
-
-# 7. Apps
-print("\n[7] Тест POST /api/devices/{device_id}/apps...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/apps",
-        headers=device_headers,
-        json={
-            "apps": [
-                {
-                    "package_name": "com.example.app",
-                    "app_name": "Example App",
-                    "version": "1.0.0",
-                    "install_time": datetime.now().isoformat()
-                }
-            ],
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("apps", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("apps", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("apps", False))
-
-# 8. Contacts
-print("\n[8] Тест POST /api/devices/{device_id}/contacts...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/contacts",
-        headers=device_headers,
-        json={
-            "contacts": [
-                {
-                    "name": "John Doe",
-                    "phone": "+380123456789",
-                    "email": "john@example.com"
-                }
-            ],
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("contacts", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("contacts", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("contacts", False))
 
-# 9. SMS
-print("\n[9] Тест POST /api/devices/{device_id}/sms...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/sms",
-        headers=device_headers,
-        json={
-            "messages": [
-                {
-                    "sender": "+380123456789",
-                    "body": "Hello",
-                    "timestamp": datetime.now().isoformat(),
-                    "is_read": True
-                }
-            ],
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("sms", True))
+    test_results = []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outcomes = executor.map(lambda test: run_test(*test), PAYLOADS)
+        for i, ((name, _), (ok, detail)) in enumerate(zip(PAYLOADS, outcomes), 1):
+            out(f"[{i}] Тест POST /api/devices/{{device_id}}/{name}...")
+            out(f"   {detail}\n")
+            test_results.append((name, ok))
+
+    # Итоги
+    out("\n" + "="*60)
+    out("[RESULTS] Результаты тестирования:")
+    out("="*60)
+    passed = sum(1 for _, result in test_results if result)
+    total = len(test_results)
+    for name, result in test_results:
+        status = "[OK]" if result else "[FAIL]"
+        out(f"  {status} {name}")
+    out("="*60)
+    out(f"[SUMMARY] Пройдено: {passed}/{total}")
+    if passed == total:
+        out("[OK] Все тесты пройдены успешно!")
     else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("sms", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("sms", False))
+        out(f"[WARN] Не пройдено: {total - passed} тестов")
+    out("="*60)
 
-# 10. Call Logs
-print("\n[10] Тест POST /api/devices/{device_id}/call-logs...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/call-logs",
-        headers=device_headers,
-        json={
-            "calls": [
-                {
-                    "number": "+380123456789",
-                    "type": "incoming",
-                    "duration": 120,
-                    "timestamp": datetime.now().isoformat()
-                }
-            ],
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("call-logs", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("call-logs", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("call-logs", False))
 
-# 11. Heartbeat
-print("\n[11] Тест POST /api/devices/{device_id}/heartbeat...")
-try:
-    r = requests.post(
-        f"{BASE_URL}/api/devices/{DEVICE_ID}/heartbeat",
-        headers=device_headers,
-        json={
-            "status": "online",
-            "timestamp": datetime.now().isoformat()
-        }
-    )
-    if r.status_code == 200:
-        print(f"   [OK] Успешно: {r.json()}")
-        test_results.append(("heartbeat", True))
-    else:
-        print(f"   [ERROR] Статус: {r.status_code}, Ответ: {r.text[:200]}")
-        test_results.append(("heartbeat", False))
-except Exception as e:
-    print(f"   [ERROR] Ошибка: {e}")
-    test_results.append(("heartbeat", False))
+def main():
+    # Весь вывод копится и пишется в stdout одной операцией (в том числе при exit)
+    lines = []
+    try:
+        run(lines.append)
+    finally:
+        sys.stdout.write("\n".join(lines) + "\n")
 
-# Итоги
-print("\n" + "="*60)
-print("[RESULTS] Результаты тестирования:")
-print("="*60)
-passed = sum(1 for _, result in test_results if result)
-total = len(test_results)
-for name, result in test_results:
-    status = "[OK]" if result else "[FAIL]"
-    print(f"  {status} {name}")
-print("="*60)
-print(f"[SUMMARY] Пройдено: {passed}/{total}")
-if passed == total:
-    print("[OK] Все тесты пройдены успешно!")
-else:
-    print(f"[WARN] Не пройдено: {total - passed} тестов")
-print("="*60)
 
+if __name__ == "__main__":
+    main()